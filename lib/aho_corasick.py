@@ -0,0 +1,73 @@
+"""
+Aho-Corasick automaton for matching many keywords against a text in a single pass
+"""
+
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Case-insensitive multi keyword matcher. The automaton is built once and every lookup
+    walks the text only once, irrespective of the number of keywords.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted({each.lower() for each in keywords if each})
+        self.goto = [{}]
+        self.fail = [0]
+        self.terminal = [False]
+        for each_keyword in self.keywords:
+            self.__add_keyword(each_keyword)
+        self.__build_failure_links()
+
+    def __add_keyword(self, keyword):
+        """
+        Adds the keyword to the trie
+        :param keyword: str
+        :return: None
+        """
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.terminal.append(False)
+            state = next_state
+        self.terminal[state] = True
+
+    def __build_failure_links(self):
+        """
+        Computes the failure links of the trie in breadth first order
+        :return: None
+        """
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.terminal[self.fail[next_state]]:
+                    self.terminal[next_state] = True
+
+    def search(self, text):
+        """
+        Checks whether any of the keywords occurs in the text
+        :param text: str
+        :return: bool
+        """
+        if not text or not self.keywords:
+            return False
+        state = 0
+        for char in text.lower():
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.terminal[state]:
+                return True
+        return False
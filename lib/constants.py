@@ -17,4 +17,14 @@ PREDICATE_MAP = {
     "equals": str,
     "less_than": datetime,
     "more_than": datetime,
+    "in_list": list,
+    "domain_in": list,
+    "contains_any": list,
+    "matches_regex": str,
 }
+
+SENDER_FIELD = "email_from"
+
+ADDRESS_PATTERN = r"<([^<>]+)>"
+
+DOMAIN_PATTERN = r"@([^@> ]+)"
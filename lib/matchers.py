@@ -0,0 +1,95 @@
+"""
+Helpers to normalise and match the values of the set based rule predicates
+"""
+
+import re
+
+from lib.constants import ADDRESS_PATTERN, DOMAIN_PATTERN, SENDER_FIELD
+
+LIKE_ESCAPE_PATTERN = re.compile(r"([\\%_])")
+
+# Escapes and groups which Python re and Postgres ARE read differently or only one supports,
+# e.g. \b is a word boundary in Python but a backspace in Postgres, (?P<name>..) is Python only
+UNSUPPORTED_REGEX_PATTERN = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[bBmMyY]|\(\?(?![:=!]))")
+
+
+def sender_address(value):
+    """
+    Extracts the email address of a 'Name <address>' sender, else returns the value as is
+    :param value: str
+    :return: str
+    """
+    address = re.search(ADDRESS_PATTERN, value or "")
+    return address.group(1) if address else value
+
+
+def sender_domain(value):
+    """
+    Extracts the domain of the sender
+    :param value: str
+    :return: str or None
+    """
+    domain = re.search(DOMAIN_PATTERN, value or "")
+    return domain.group(1) if domain else None
+
+
+def escape_like(value):
+    """
+    Escapes the like wildcards so that the value is matched literally
+    :param value: str
+    :return: str
+    """
+    return LIKE_ESCAPE_PATTERN.sub(r"\\\1", value)
+
+
+def parse_values(value):
+    """
+    Parses the value of a set based predicate into a de-duplicated lowercase list.
+    Accepts a list, a comma separated string or file:<path> with one entry per line
+    :param value: str or list
+    :return: list
+    """
+    if isinstance(value, str):
+        if value.startswith("file:"):
+            with open(value[len("file:") :]) as values_file:
+                value = values_file.read().splitlines()
+        else:
+            value = value.split(",")
+    return sorted({each.strip().lower() for each in value if each.strip()})
+
+
+def normalise_values(value, predicate, field):
+    """
+    Parses the value of a set based predicate and normalises the entries for the field, i.e.
+    sender addresses for in_list on the sender and bare domains for domain_in
+    :param value: str or list
+    :param predicate: str
+    :param field: str
+    :return: list
+    """
+    values = parse_values(value)
+    if predicate == "in_list" and field == SENDER_FIELD:
+        values = sorted({sender_address(each).strip() for each in values})
+    elif predicate == "domain_in":
+        values = sorted({each.lstrip("@") for each in values if each.lstrip("@")})
+    return values
+
+
+def validate_regex(pattern):
+    """
+    Validates that the regex is within the syntax shared by Python re (in memory evaluation)
+    and Postgres (the ~ operator), i.e. no \\b, \\B, \\m, \\M, \\y, \\Y escapes and no (?..)
+    groups other than (?:..), (?=..) and (?!..)
+    :param pattern: str
+    :return: None
+    """
+    try:
+        re.compile(pattern)
+    except re.error as ex:
+        raise ValueError(f"Invalid regex config - {ex}")
+    unsupported = UNSUPPORTED_REGEX_PATTERN.search(pattern)
+    if unsupported is not None:
+        raise ValueError(
+            f"Invalid regex config - {unsupported.group(0)!r} is not supported by both "
+            "the database and the in memory evaluation"
+        )
@@ -76,7 +76,12 @@ class EmailBody(Base):
         return self.__tablename__
 
 
-Base.metadata.create_all(postgresql_engine)
+def email_db_setup():
+    """
+    Creates the tables which do not exist yet
+    :return: None
+    """
+    Base.metadata.create_all(postgresql_engine)
 
 
 def email_db_cleanup():
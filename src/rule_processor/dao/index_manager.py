@@ -0,0 +1,346 @@
+"""
+Workload driven index manager which derives the indexes from the configured rules
+"""
+
+import re
+
+from sqlalchemy import select, text
+
+from lib.constants import ADDRESS_PATTERN, DOMAIN_PATTERN, FIELD_MAP, SENDER_FIELD
+from lib.db import postgresql_engine
+from lib.log import logger
+from src.rule_processor.dao.email_db import EmailMetadata, EmailBody
+
+INDEX_PREFIX = "ix_rule_"
+
+# Kept in line with the where clauses built by the in_list and domain_in predicates
+ADDRESS_EXPRESSION = f"coalesce(substring({{column}}, '{ADDRESS_PATTERN}'), {{column}})"
+DOMAIN_EXPRESSION = f"lower(substring({{column}}, '{DOMAIN_PATTERN}'))"
+
+# Email bodies often exceed the btree row size limit, so only trigram indexes are built
+TRIGRAM_ONLY_FIELDS = ("data",)
+
+CAST_PATTERN = re.compile(r"::(?:character varying|double precision|[\w\[\]]+)")
+
+INDEX_KIND_MAP = {
+    "equals": "btree",
+    "less_than": "btree",
+    "more_than": "btree",
+    "contains": "trigram",
+    "matches_regex": "trigram",
+    "in_list": "lower",
+    "domain_in": "domain",
+}
+
+DATE_FIELD = "received_date"
+
+
+class IndexManager:
+    """
+    Looks at the configured rule groups (fields x predicates) and creates or drops the
+    matching indexes concurrently, reporting the estimated planner cost benefit
+    """
+
+    def __init__(self, rule_groups):
+        self.rule_groups = rule_groups
+        self.report = []
+
+    @staticmethod
+    def table_of(field):
+        """
+        Gets the table name holding the field
+        :param field: str
+        :return: str
+        """
+        column = EmailMetadata.getattr(field) or EmailBody.getattr(field)
+        return column.table.name
+
+    def recommend(self):
+        """
+        Derives the indexes required by the configured rule groups
+        :return: dict
+        """
+        indexes = {}
+        for each_group in self.rule_groups:
+            for each_condition in each_group.conditions:
+                field = each_condition.field_obj.field
+                predicate = each_condition.predicate_obj.predicate
+                kind = INDEX_KIND_MAP.get(predicate)
+                if kind is None or not FIELD_MAP.get(field):
+                    continue
+                self.__add_index(indexes, field, kind, each_condition)
+            self.__add_composite_index(indexes, each_group)
+        return indexes
+
+    def __add_index(self, indexes, field, kind, condition):
+        """
+        Adds the index definition of the given kind for the field
+        :param indexes: dict
+        :param field: str
+        :param kind: str
+        :param condition: Condition
+        :return: None
+        """
+        if field in TRIGRAM_ONLY_FIELDS and kind != "trigram":
+            return
+        table = self.table_of(field)
+        name = f"{INDEX_PREFIX}{table}_{field}_{kind}"
+        if kind == "trigram":
+            definition = f"USING gin ({field} gin_trgm_ops)"
+        elif kind == "lower":
+            column = (
+                ADDRESS_EXPRESSION.format(column=field)
+                if field == SENDER_FIELD
+                else field
+            )
+            definition = f"USING btree (lower({column}))"
+        elif kind == "domain":
+            definition = f"USING btree (({DOMAIN_EXPRESSION.format(column=field)}))"
+        else:
+            definition = f"USING btree ({field})"
+        index = indexes.setdefault(
+            name, {"name": name, "table": table, "kind": kind, "definition": definition}
+        )
+        index.setdefault("conditions", []).append(condition)
+
+    def __add_composite_index(self, indexes, rule_group):
+        """
+        Adds the composite sender and date index when both are filtered together
+        :param indexes: dict
+        :param rule_group: ConditionActionGroup
+        :return: None
+        """
+        if rule_group.rule_group_predicate != "all":
+            return
+        sender_conditions = [
+            each
+            for each in rule_group.conditions
+            if each.field_obj.field == SENDER_FIELD
+            and each.predicate_obj.predicate in ("equals", "in_list")
+        ]
+        date_conditions = [
+            each for each in rule_group.conditions if each.field_obj.field == DATE_FIELD
+        ]
+        if not sender_conditions or not date_conditions:
+            return
+        sender = (
+            f"lower({ADDRESS_EXPRESSION.format(column=SENDER_FIELD)})"
+            if sender_conditions[0].predicate_obj.predicate == "in_list"
+            else SENDER_FIELD
+        )
+        kind = "lower_composite" if sender != SENDER_FIELD else "composite"
+        table = self.table_of(SENDER_FIELD)
+        name = f"{INDEX_PREFIX}{table}_{SENDER_FIELD}_{DATE_FIELD}_{kind}"
+        index = indexes.setdefault(
+            name,
+            {
+                "name": name,
+                "table": table,
+                "kind": kind,
+                "definition": f"USING btree ({sender}, {DATE_FIELD})",
+            },
+        )
+        index.setdefault("conditions", []).extend(sender_conditions + date_conditions)
+
+    @staticmethod
+    def existing_indexes(connection):
+        """
+        Lists the indexes of the email tables along with their definition and validity. A
+        failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+        :param connection: sqlalchemy Connection
+        :return: dict
+        """
+        rows = connection.execute(
+            text(
+                "SELECT index_class.relname, table_class.relname, "
+                "pg_get_indexdef(pg_index.indexrelid), pg_index.indisvalid "
+                "FROM pg_index "
+                "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+                "JOIN pg_class table_class ON table_class.oid = pg_index.indrelid "
+                "WHERE table_class.relname = ANY(:tables)"
+            ),
+            {"tables": [EmailMetadata.__tablename__, EmailBody.__tablename__]},
+        )
+        return {
+            each[0]: {"table": each[1], "definition": each[2], "valid": each[3]}
+            for each in rows
+        }
+
+    @staticmethod
+    def normalise_definition(definition):
+        """
+        Normalises an index definition, as written here or as returned by pg_get_indexdef, to
+        compare the access method and the indexed columns or expressions
+        :param definition: str
+        :return: str
+        """
+        definition = definition.split("USING ", 1)[-1].lower()
+        definition = CAST_PATTERN.sub("", definition)
+        return re.sub(r'[\s()"]', "", definition)
+
+    def find_duplicate(self, indexes, index):
+        """
+        Finds a valid index, other than the given one, with the same definition
+        :param indexes: dict
+        :param index: dict
+        :return: str or None
+        """
+        definition = self.normalise_definition(index["definition"])
+        for name, existing in indexes.items():
+            if (
+                name != index["name"]
+                and existing["valid"]
+                and existing["table"] == index["table"]
+                and self.normalise_definition(existing["definition"]) == definition
+            ):
+                return name
+        return None
+
+    @staticmethod
+    def create_trigram_extension(connection):
+        """
+        Creates the pg_trgm extension, which usually needs elevated privileges
+        :param connection: sqlalchemy Connection
+        :return: bool, whether the extension is available
+        """
+        try:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except Exception as ex:
+            logger.warning(
+                "Unable to create the pg_trgm extension, skipping the trigram indexes: %s"
+                % ex
+            )
+            return False
+        return True
+
+    @staticmethod
+    def drop_index(connection, name):
+        """
+        Drops the index concurrently
+        :param connection: sqlalchemy Connection
+        :param name: str
+        :return: None
+        """
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    @staticmethod
+    def estimate_cost(connection, conditions):
+        """
+        Estimates the planner cost of the rule filters served by an index
+        :param connection: sqlalchemy Connection
+        :param conditions: list
+        :return: float
+        """
+        cost = 0.0
+        for each_condition in conditions:
+            statement = (
+                select(EmailMetadata)
+                .join(EmailBody)
+                .filter(each_condition.generate_where_clause())
+            )
+            compiled = statement.compile(dialect=connection.dialect)
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+            ).scalar()
+            cost += plan[0]["Plan"]["Total Cost"]
+        return cost
+
+    def apply(self, drop_unused=True):
+        """
+        Creates the recommended indexes and drops the managed indexes no longer required
+        :param drop_unused: bool
+        :return: list
+        """
+        recommended = self.recommend()
+        self.report = []
+        with postgresql_engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            indexes = self.existing_indexes(connection)
+            managed = {name for name in indexes if name.startswith(INDEX_PREFIX)}
+            trigram_available = True
+            if any(each["kind"] == "trigram" for each in recommended.values()):
+                trigram_available = self.create_trigram_extension(connection)
+
+            for name, index in recommended.items():
+                current = indexes.get(name)
+                if (
+                    index["kind"] == "trigram"
+                    and not trigram_available
+                    and current is None
+                ):
+                    self.report.append(
+                        {"index": name, "action": "skipped, pg_trgm unavailable"}
+                    )
+                    continue
+                if current is not None and not current["valid"]:
+                    logger.warning("Index %s is invalid, rebuilding it" % name)
+                    self.drop_index(connection, name)
+                    current = None
+                duplicate = self.find_duplicate(indexes, index)
+                if duplicate is not None:
+                    if current is not None:
+                        self.drop_index(connection, name)
+                        action = f"dropped, duplicate of {duplicate}"
+                    else:
+                        action = f"skipped, already covered by {duplicate}"
+                    self.report.append({"index": name, "action": action})
+                    continue
+                if current is not None:
+                    self.report.append({"index": name, "action": "kept"})
+                    continue
+                try:
+                    cost_before = self.estimate_cost(connection, index["conditions"])
+                    logger.info("Creating index %s" % name)
+                    connection.execute(
+                        text(
+                            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                            f"ON {index['table']} {index['definition']}"
+                        )
+                    )
+                    connection.execute(text(f"ANALYZE {index['table']}"))
+                    cost_after = self.estimate_cost(connection, index["conditions"])
+                except Exception as ex:
+                    logger.error(
+                        "Error occurred while creating index %s: %s" % (name, ex)
+                    )
+                    self.drop_index(connection, name)
+                    continue
+                self.report.append(
+                    {
+                        "index": name,
+                        "action": "created",
+                        "cost_before": cost_before,
+                        "cost_after": cost_after,
+                        "estimated_benefit": cost_before - cost_after,
+                    }
+                )
+
+            for name in sorted(managed - set(recommended)):
+                if indexes[name]["valid"] and not drop_unused:
+                    continue
+                logger.info("Dropping unused or invalid index %s" % name)
+                self.drop_index(connection, name)
+                self.report.append({"index": name, "action": "dropped"})
+        return self.report
+
+    def log_report(self):
+        """
+        Logs the index changes along with their estimated benefit
+        :return: None
+        """
+        if not self.report:
+            logger.info("No index changes required for the configured rules")
+        for each in self.report:
+            if each["action"] == "created":
+                logger.info(
+                    "Index %s created, estimated planner cost %.2f -> %.2f (benefit %.2f)"
+                    % (
+                        each["index"],
+                        each["cost_before"],
+                        each["cost_after"],
+                        each["estimated_benefit"],
+                    )
+                )
+            else:
+                logger.info("Index %s %s" % (each["index"], each["action"]))
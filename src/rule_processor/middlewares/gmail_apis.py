@@ -4,15 +4,25 @@ Helper module to talk with gmail apis.
 
 import json
 import os.path
+import time
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 from lib.log import logger
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
+BATCH_SIZE = 50
+BATCH_RETRIES = 3
+# Rate limited and server side failures are transient, the rest fail again on a retry
+RETRY_STATUS_CODES = (429,)
+RETRY_MIN_SERVER_ERROR = 500
+METADATA_HEADERS = ["From", "Subject"]
+# batchModify rejects requests with more than 1000 message ids
+BATCH_MODIFY_LIMIT = 1000
 
 
 class GmailApi:
@@ -70,9 +80,111 @@ class GmailApi:
         except Exception as error:
             logger.error("Error occurred while getting messages from gmail: %s" % error)
 
+    def list_message_ids(self, query):
+        """
+        List the ids of all the messages matching the gmail search query
+        :param query: str
+        :return: list
+        """
+        try:
+            logger.info("Listing the emails matching the query %s" % query)
+            service = build("gmail", "v1", credentials=self.credentials)
+            message_ids = []
+            page_token = None
+            while True:
+                results = (
+                    service.users()
+                    .messages()
+                    .list(userId="me", q=query, pageToken=page_token)
+                    .execute()
+                )
+                message_ids.extend(each["id"] for each in results.get("messages", []))
+                page_token = results.get("nextPageToken")
+                if not page_token:
+                    break
+            logger.info("%s emails matched the query" % len(message_ids))
+            return message_ids
+
+        except Exception as error:
+            logger.error("Error occurred while listing messages from gmail: %s" % error)
+            raise
+
+    @staticmethod
+    def is_retryable(exception):
+        """
+        Checks whether the failed request is worth retrying, i.e. it was rate limited or
+        failed server side
+        :param exception: Exception
+        :return: bool
+        """
+        if not isinstance(exception, HttpError):
+            return False
+        status = int(exception.resp.status)
+        return status in RETRY_STATUS_CODES or status >= RETRY_MIN_SERVER_ERROR
+
+    def get_messages_by_ids(self, message_ids, message_format="full"):
+        """
+        Fetch the email data and metadata of the given message ids. Rate limited and server
+        side failures of the batch are retried with a backoff and skipped after that, other
+        failures are skipped right away
+        :param message_ids: list
+        :param message_format: str, "metadata" fetches only the From and Subject headers
+        :return: list
+        """
+        service = build("gmail", "v1", credentials=self.credentials)
+        result = []
+        failed = []
+        skipped = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                result.append(response)
+            elif self.is_retryable(exception):
+                logger.debug("Fetching email %s failed: %s" % (request_id, exception))
+                failed.append(request_id)
+            else:
+                logger.warning("Fetching email %s failed: %s" % (request_id, exception))
+                skipped.append(request_id)
+
+        options = {"format": message_format}
+        if message_format == "metadata":
+            options["metadataHeaders"] = METADATA_HEADERS
+
+        pending = list(message_ids)
+        for attempt in range(BATCH_RETRIES + 1):
+            failed.clear()
+            for index in range(0, len(pending), BATCH_SIZE):
+                batch = service.new_batch_http_request(callback=callback)
+                for msg_id in pending[index : index + BATCH_SIZE]:
+                    batch.add(
+                        service.users()
+                        .messages()
+                        .get(userId="me", id=msg_id, **options),
+                        request_id=msg_id,
+                    )
+                batch.execute()
+
+            pending = list(failed)
+            if not pending:
+                break
+            if attempt < BATCH_RETRIES:
+                logger.info(
+                    "Retrying %s failed email fetches, attempt %s"
+                    % (len(pending), attempt + 1)
+                )
+                time.sleep(2**attempt)
+
+        skipped.extend(pending)
+        if skipped:
+            logger.warning(
+                "Skipping %s emails which could not be fetched: %s"
+                % (len(skipped), ", ".join(skipped))
+            )
+        return result
+
     def do_actions(self, action_payload, desc):
         """
-        Modify the labels of the email
+        Modify the labels of the email, in chunks of at most BATCH_MODIFY_LIMIT ids
         :param action_payload: dict
         :param desc: str
         :return: None
@@ -80,12 +192,13 @@ class GmailApi:
         try:
             logger.debug("Entering do_actions()")
             service = build("gmail", "v1", credentials=self.credentials)
-            request = (
-                service.users().messages().batchModify(userId="me", body=action_payload)
-            )
-            results = request.execute()
-            if results == "":
-                logger.info("Email action - %s applied successfully" % desc)
+            message_ids = action_payload.get("ids", [])
+            for index in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+                body = dict(
+                    action_payload, ids=message_ids[index : index + BATCH_MODIFY_LIMIT]
+                )
+                service.users().messages().batchModify(userId="me", body=body).execute()
+            logger.info("Email action - %s applied successfully" % desc)
             logger.debug("Exiting do_actions()")
 
         except Exception as ex:
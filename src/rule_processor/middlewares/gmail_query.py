@@ -0,0 +1,118 @@
+"""
+Compiles the rule conditions to Gmail search queries so that the candidate emails can be listed
+server side instead of downloading the entire mailbox.
+"""
+
+import base64
+import re
+from datetime import datetime, timedelta
+
+from lib.constants import SENDER_FIELD
+from lib.log import logger
+from lib.matchers import sender_address
+
+MAX_PUSHDOWN_VALUES = 50
+SEARCH_VALUE_PATTERN = re.compile(r"^[\w .@+'-]+$")
+# Sender predicates whose from: results include every true match. Subject and body search
+# matches whole words, so substring predicates such as contains cannot be pushed down
+SENDER_PUSHDOWN_PREDICATES = ("equals", "in_list", "domain_in")
+
+
+class GmailQueryCompiler:
+    """
+    Compiles a ConditionActionGroup to a Gmail `q=` search expression. Conditions which cannot
+    be expressed in Gmail search are kept as residual conditions for local evaluation.
+
+    Only the terms whose Gmail results include every true match are pushed down: the date
+    ranges, which are exact, and the sender equals/in_list/domain_in, which match the sender
+    address and return candidates that still have to be evaluated locally.
+    """
+
+    def __init__(self, rule_group):
+        self.rule_group = rule_group
+        self.query = None
+        self.residual = []
+        self.exact = True
+        self.compile()
+
+    def compile(self):
+        """
+        Builds the Gmail search query for the rule group
+        :return: str
+        """
+        terms = []
+        for each_condition in self.rule_group.conditions:
+            term = self.compile_condition(each_condition)
+            if term is None:
+                self.residual.append(each_condition)
+            else:
+                terms.append(term)
+
+        if self.residual:
+            self.exact = False
+        if self.rule_group.rule_group_predicate == "any":
+            if terms and not self.residual:
+                self.query = "{%s}" % " ".join(terms)
+        elif terms:
+            self.query = " ".join(terms)
+        logger.debug(
+            "Compiled gmail query %s with %s residual conditions"
+            % (self.query, len(self.residual))
+        )
+        return self.query
+
+    def compile_condition(self, condition):
+        """
+        Compiles a single condition to a Gmail search term
+        :param condition: Condition
+        :return: str or None when the condition cannot be pushed down
+        """
+        field = condition.field_obj.field
+        predicate = condition.predicate_obj.predicate
+        value = condition.value
+
+        if field == "received_date" and predicate in ("less_than", "more_than"):
+            args = {condition.time_entity: int(value)}
+            bound_range = datetime.now().today() - timedelta(**args)
+            operator = "after:" if predicate == "less_than" else "before:"
+            return f"{operator}{int(bound_range.timestamp())}"
+
+        if field != SENDER_FIELD or predicate not in SENDER_PUSHDOWN_PREDICATES:
+            return None
+
+        values = [value] if predicate == "equals" else value
+        values = [sender_address(each).strip() for each in values]
+        if not values or len(values) > MAX_PUSHDOWN_VALUES:
+            return None
+        if not all(SEARCH_VALUE_PATTERN.match(each) for each in values):
+            return None
+
+        self.exact = False
+        return "from:(%s)" % " OR ".join(f'"{each}"' for each in values)
+
+
+def gmail_record(gmail_data):
+    """
+    Transforms the gmail message to a record of rule fields for local evaluation
+    :param gmail_data: dict
+    :return: dict
+    """
+    headers = {
+        each_header["name"]: each_header["value"]
+        for each_header in gmail_data["payload"].get("headers", [])
+    }
+    parts = [
+        base64.urlsafe_b64decode(each_part["body"]["data"]).decode(
+            "utf-8", errors="replace"
+        )
+        for each_part in gmail_data["payload"].get("parts", [])
+        if each_part["body"].get("data")
+    ]
+    return {
+        "email_from": headers.get("From"),
+        "subject": headers.get("Subject"),
+        "received_date": datetime.utcfromtimestamp(
+            int(gmail_data["internalDate"]) / 1000
+        ),
+        "data": "\n".join(parts),
+    }
@@ -0,0 +1,267 @@
+"""
+Diagnostics module to capture the generated SQL and its query plan for the rule engine
+"""
+
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+from lib.constants import FIELD_MAP
+from lib.log import logger
+from src.rule_processor.dao.index_manager import IndexManager
+
+SEQ_SCAN_NODES = ("Seq Scan", "Parallel Seq Scan")
+MISSING_INDEX_ROWS_THRESHOLD = 1000
+DIAGNOSTICS_DIR = "logs"
+PARAM_VALUES_LIMIT = 5
+
+CLAUSE_SPLIT_PATTERN = re.compile(r"\s(?:AND|OR)\s")
+PATTERN_MATCH_PATTERN = re.compile(r"~~\*?|~\*?")
+
+
+class QueryDiagnostics:
+    """
+    Collects the SQL, EXPLAIN (ANALYZE, BUFFERS) output, execution time and rows returned of
+    every rule group it executes, and ranks them into a slow rule report
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def execute(self, session, statement, rule_group):
+        """
+        Explains and executes the statement, recording the diagnostics for the rule group
+        :param session: sqlalchemy Session
+        :param statement: sqlalchemy select
+        :param rule_group: str
+        :return: list
+        """
+        compiled = statement.compile(dialect=session.get_bind().dialect)
+        sql = str(compiled)
+        params = compiled.params
+        plan = None
+        indexes = {}
+        try:
+            indexes = self.index_definitions(session)
+            explain = session.connection().exec_driver_sql(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params
+            )
+            plan = explain.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plan = plan[0]
+        except Exception as ex:
+            logger.warning("Unable to capture query plan for %s: %s" % (rule_group, ex))
+            session.rollback()
+
+        start_time = time.perf_counter()
+        rows = session.execute(statement).all()
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+        record = {
+            "rule_group": rule_group,
+            "sql": sql,
+            "params": params,
+            "plan": plan,
+            "execution_time_ms": elapsed_ms,
+            "plan_execution_time_ms": plan.get("Execution Time") if plan else None,
+            "shared_hit_blocks": (
+                plan["Plan"].get("Shared Hit Blocks") if plan else None
+            ),
+            "shared_read_blocks": (
+                plan["Plan"].get("Shared Read Blocks") if plan else None
+            ),
+            "rows": len(rows),
+            "seq_scans": [],
+            "missing_indexes": [],
+        }
+        if plan:
+            self.inspect_plan(plan["Plan"], record, indexes)
+        self.records.append(record)
+        logger.debug("Captured diagnostics for %s: %s" % (rule_group, sql))
+        return rows
+
+    @staticmethod
+    def index_definitions(session):
+        """
+        Gets the normalised definitions of the valid indexes of the email tables
+        :param session: sqlalchemy Session
+        :return: dict, table name to list of definitions
+        """
+        indexes = {}
+        for each in IndexManager.existing_indexes(session.connection()).values():
+            if each["valid"]:
+                indexes.setdefault(each["table"], []).append(
+                    IndexManager.normalise_definition(each["definition"])
+                )
+        return indexes
+
+    def inspect_plan(self, node, record, indexes):
+        """
+        Walks the plan tree and flags the sequential scans and the filters which no existing
+        index can serve
+        :param node: dict
+        :param record: dict
+        :param indexes: dict, table name to list of normalised index definitions
+        :return: None
+        """
+        if node.get("Node Type") in SEQ_SCAN_NODES:
+            relation = node.get("Relation Name")
+            record["seq_scans"].append(relation)
+            rows_removed = node.get("Rows Removed by Filter", 0)
+            if node.get("Filter") and rows_removed >= MISSING_INDEX_ROWS_THRESHOLD:
+                for kind, column in self.required_indexes(node["Filter"]):
+                    if not self.has_index(indexes.get(relation, []), kind, column):
+                        record["missing_indexes"].append(
+                            f"{kind} index on {relation}({column})"
+                        )
+        for each_node in node.get("Plans", []):
+            self.inspect_plan(each_node, record, indexes)
+
+    @staticmethod
+    def filter_columns(filter_condition):
+        """
+        Extracts the rule fields referenced by a plan filter condition
+        :param filter_condition: str
+        :return: list
+        """
+        return [
+            field
+            for field in FIELD_MAP
+            if re.search(rf"\b{field}\b", filter_condition) is not None
+        ]
+
+    def required_indexes(self, filter_condition):
+        """
+        Derives the kind of index each clause of the plan filter needs: an expression index
+        for lower()/substring(), a trigram index for like and regex matches, else a btree
+        :param filter_condition: str
+        :return: list of (kind, column)
+        """
+        required = []
+        for each_clause in CLAUSE_SPLIT_PATTERN.split(filter_condition):
+            clause = each_clause.lower()
+            if "substring" in clause or "lower(" in clause:
+                kind = "expression"
+            elif PATTERN_MATCH_PATTERN.search(clause):
+                kind = "trigram"
+            else:
+                kind = "btree"
+            for column in self.filter_columns(clause):
+                if (kind, column) not in required:
+                    required.append((kind, column))
+        return required
+
+    @staticmethod
+    def has_index(definitions, kind, column):
+        """
+        Checks whether any of the normalised index definitions serves the kind of filter
+        :param definitions: list
+        :param kind: str
+        :param column: str
+        :return: bool
+        """
+        for definition in definitions:
+            if kind == "trigram" and f"{column}gin_trgm_ops" in definition:
+                return True
+            if kind == "btree" and definition.startswith(f"btree{column}"):
+                return True
+            if (
+                kind == "expression"
+                and definition.startswith("btree")
+                and column in definition
+                and ("lower" in definition or "substring" in definition)
+            ):
+                return True
+        return False
+
+    @staticmethod
+    def elapsed(record):
+        """
+        Gets the execution time of the rule group as measured by EXPLAIN ANALYZE, falling back
+        to the wall clock time of the query when the plan could not be captured
+        :param record: dict
+        :return: float
+        """
+        return record["plan_execution_time_ms"] or record["execution_time_ms"]
+
+    def report(self):
+        """
+        Ranks the captured rule groups with the slowest first
+        :return: list
+        """
+        return sorted(self.records, key=self.elapsed, reverse=True)
+
+    @staticmethod
+    def format_params(params):
+        """
+        Formats the bound parameters for the log, truncating long lists
+        :param params: dict
+        :return: str
+        """
+        formatted = []
+        for name, value in params.items():
+            if isinstance(value, list) and len(value) > PARAM_VALUES_LIMIT:
+                value = "[%s, ... +%s more]" % (
+                    ", ".join(str(each) for each in value[:PARAM_VALUES_LIMIT]),
+                    len(value) - PARAM_VALUES_LIMIT,
+                )
+            formatted.append(f"{name}={value}")
+        return ", ".join(formatted)
+
+    def save(self, path=None):
+        """
+        Writes the ranked records, including the full query plans, as JSON
+        :param path: str, defaults to a timestamped file under the logs directory
+        :return: str, the path written
+        """
+        if path is None:
+            os.makedirs(DIAGNOSTICS_DIR, exist_ok=True)
+            path = os.path.join(
+                DIAGNOSTICS_DIR,
+                f"rule_diagnostics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            )
+        with open(path, "w") as diagnostics_file:
+            json.dump(self.report(), diagnostics_file, indent=2, default=str)
+        return path
+
+    def log_report(self):
+        """
+        Logs the slow rule report and saves the query plans
+        :return: None
+        """
+        if not self.records:
+            logger.info("No rule diagnostics captured")
+            return
+        logger.info("Slow rule report")
+        for rank, record in enumerate(self.report(), start=1):
+            logger.info(
+                "%s. %s - %.2f ms, %s rows"
+                % (
+                    rank,
+                    record["rule_group"],
+                    self.elapsed(record),
+                    record["rows"],
+                )
+            )
+            logger.info("   SQL: %s" % record["sql"])
+            logger.info("   Params: %s" % self.format_params(record["params"]))
+            if record["plan"]:
+                logger.info(
+                    "   Buffers: shared hit %s, read %s blocks"
+                    % (record["shared_hit_blocks"], record["shared_read_blocks"])
+                )
+                logger.debug("   Plan: %s" % json.dumps(record["plan"]))
+            if record["seq_scans"]:
+                logger.warning(
+                    "   Sequential scan on %s"
+                    % ", ".join(sorted(set(record["seq_scans"])))
+                )
+            if record["missing_indexes"]:
+                logger.warning(
+                    "   Possible missing %s"
+                    % ", ".join(sorted(set(record["missing_indexes"])))
+                )
+        logger.info("Query plans saved to %s" % self.save())
@@ -2,16 +2,40 @@
 Rule engine module to handle the conditions, predicates, and actions
 """
 
+import re
 from datetime import datetime, timedelta
 
-from sqlalchemy import select
+from sqlalchemy import Text, any_, false, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
 
-from lib.constants import FIELD_MAP, PREDICATE_MAP
+from lib.aho_corasick import AhoCorasick
+from lib.constants import (
+    ADDRESS_PATTERN,
+    DOMAIN_PATTERN,
+    FIELD_MAP,
+    PREDICATE_MAP,
+    SENDER_FIELD,
+)
 from lib.db import postgresql_engine
 from lib.log import logger
-from src.rule_processor.dao.email_db import EmailMetadata, EmailBody
+from lib.matchers import (
+    escape_like,
+    normalise_values,
+    sender_address,
+    sender_domain,
+    validate_regex,
+)
+from src.rule_processor.dao.email_db import EmailMetadata, EmailBody, email_db_setup
+from src.rule_processor.dao.index_manager import IndexManager
 from src.rule_processor.middlewares.gmail_apis import GmailApi
+from src.rule_processor.middlewares.gmail_query import GmailQueryCompiler, gmail_record
+
+IN_MEMORY_PREDICATES = ("contains_any",)
+# Short keyword lists are cheaper as a single ilike any, longer ones go to the automaton
+IN_MEMORY_VALUES_THRESHOLD = 100
+STREAM_BATCH_SIZE = 1000
+DESCRIBE_VALUES_LIMIT = 5
 
 
 class Field:
@@ -89,6 +113,84 @@ class Predicate:
         bound_range = datetime.now().today() - timedelta(**args)
         return key < bound_range
 
+    def in_list(self, key, value, **kwargs):
+        """
+        Creates a where clause matching any of the values, bound as a single array. The sender
+        is compared on its address, as the field holds the raw 'Name <address>' header
+        """
+        if not value:
+            return false()
+        if kwargs.get("field") == SENDER_FIELD:
+            key = func.coalesce(func.substring(key, ADDRESS_PATTERN), key)
+        return func.lower(key) == any_(literal(value, ARRAY(Text)))
+
+    def domain_in(self, key, value, **kwargs):
+        """Creates a where clause matching the sender domain against the domain array"""
+        if not value:
+            return false()
+        domain = func.lower(func.substring(key, DOMAIN_PATTERN))
+        return domain == any_(literal(value, ARRAY(Text)))
+
+    def contains_any(self, key, value, **kwargs):
+        """
+        Creates a where clause for ilike any of the keywords. Used for keyword lists up to
+        IN_MEMORY_VALUES_THRESHOLD; beyond that the rule engine evaluates the predicate in
+        memory with an Aho-Corasick automaton, since ilike any checks every keyword against
+        every row
+        """
+        if not value:
+            return false()
+        patterns = ["%" + escape_like(each) + "%" for each in value]
+        return key.ilike(any_(literal(patterns, ARRAY(Text))))
+
+    def matches_regex(self, key, value, **kwargs):
+        """Creates a where clause for regex match, restricted to the syntax of validate_regex"""
+        return key.regexp_match(value)
+
+    def build_matcher(self, value, **kwargs):
+        """
+        Builds a callable which evaluates the predicate in memory against a field value
+        :param value: str or list
+        :return: callable
+        """
+        if self.predicate in ("less_than", "more_than"):
+            args = {kwargs["time_entity"]: int(value)}
+            bound_range = datetime.now().today() - timedelta(**args)
+            # A missing date never matches, as with NULL in SQL
+            if self.predicate == "less_than":
+                return lambda field_value: (
+                    field_value is not None and field_value > bound_range
+                )
+            return lambda field_value: (
+                field_value is not None and field_value < bound_range
+            )
+        if self.predicate == "contains":
+            return lambda field_value: value.lower() in (field_value or "").lower()
+        if self.predicate == "does_not_contains":
+            return lambda field_value: value.lower() not in (field_value or "").lower()
+        if self.predicate == "equals":
+            return lambda field_value: field_value == value
+        if self.predicate == "does_not_equals":
+            return lambda field_value: field_value != value
+        if self.predicate == "in_list":
+            values = frozenset(value)
+            if kwargs.get("field") == SENDER_FIELD:
+                return lambda field_value: (
+                    sender_address(field_value or "").lower() in values
+                )
+            return lambda field_value: (field_value or "").lower() in values
+        if self.predicate == "domain_in":
+            domains = frozenset(value)
+            return lambda field_value: (
+                (sender_domain(field_value) or "").lower() in domains
+            )
+        if self.predicate == "contains_any":
+            return AhoCorasick(value).search
+        if self.predicate == "matches_regex":
+            pattern = re.compile(value)
+            return lambda field_value: pattern.search(field_value or "") is not None
+        return None
+
 
 class Condition:
     """
@@ -100,7 +202,12 @@ class Condition:
         self.predicate_obj = predicate
         self.value = value
         self.time_entity = None
+        self.matcher = None
         self.validate()
+        self.in_memory = (
+            predicate.predicate in IN_MEMORY_PREDICATES
+            and len(self.value) > IN_MEMORY_VALUES_THRESHOLD
+        )
         self.result = []
 
     def validate(self):
@@ -127,6 +234,26 @@ class Condition:
                 self.value = self.value * 30
                 self.time_entity = "days"
 
+        if self.predicate_obj.datatype == list:
+            self.value = normalise_values(
+                self.value, self.predicate_obj.predicate, self.field_obj.field
+            )
+
+        if self.predicate_obj.predicate == "matches_regex":
+            validate_regex(self.value)
+
+    def evaluate(self, record):
+        """
+        Evaluates the condition in memory against a record of field values
+        :param record: dict
+        :return: bool
+        """
+        if self.matcher is None:
+            self.matcher = self.predicate_obj.build_matcher(
+                self.value, time_entity=self.time_entity, field=self.field_obj.field
+            )
+        return self.matcher(record.get(self.field_obj.field))
+
     def generate_where_clause(self):
         """
         Dynamically generates the where clause based on the field, predicate and value
@@ -137,7 +264,10 @@ class Condition:
                 self.field_obj.field
             )
             where_statement = self.predicate_obj.method(
-                key, self.value, time_entity=self.time_entity
+                key,
+                self.value,
+                time_entity=self.time_entity,
+                field=self.field_obj.field,
             )
             return where_statement
 
@@ -167,54 +297,186 @@ class ConditionActionGroup:
     Condition class to handle the conditions and process the emails
     """
 
-    def __init__(self, conditions, rule_group_predicate, actions):
+    def __init__(self, conditions, rule_group_predicate, actions, diagnostics=None):
         self.conditions = conditions
         self.rule_group_predicate = rule_group_predicate
         self.actions = actions
+        self.diagnostics = diagnostics
         self.result = []
 
-    def process_emails(self):
+    def describe(self):
+        """
+        Describes the rule group in a human readable form
+        :return: str
+        """
+        joiner = " AND " if self.rule_group_predicate == "all" else " OR "
+        descriptions = []
+        for each in self.conditions:
+            value = each.value
+            if each.time_entity:
+                value = f"{value} {each.time_entity}"
+            if isinstance(value, list) and len(value) > DESCRIBE_VALUES_LIMIT:
+                value = "[%s, ... +%s more]" % (
+                    ", ".join(value[:DESCRIBE_VALUES_LIMIT]),
+                    len(value) - DESCRIBE_VALUES_LIMIT,
+                )
+            descriptions.append(
+                f"{each.field_obj.field} {each.predicate_obj.predicate} {value}"
+            )
+        return joiner.join(descriptions)
+
+    def evaluate(self, record):
+        """
+        Evaluates the rule group in memory against a record of field values
+        :param record: dict
+        :return: bool
+        """
+        matches = [each.evaluate(record) for each in self.conditions]
+        if self.rule_group_predicate == "all":
+            return all(matches)
+        return any(matches)
+
+    def process_emails(self, pushdown=False):
         """
         Core method to initiate the processing
+        :param pushdown: bool, lists the candidate emails with a gmail search query
         :return: None
         """
-        self.__filter_data()
+        if pushdown:
+            self.__filter_gmail()
+        else:
+            self.__filter_data()
         self.__apply_action()
 
+    def __filter_gmail(self):
+        """
+        Filters the emails server side with the compiled gmail search query, evaluating the
+        candidates locally when the query is not exact. Falls back to the database filter when
+        the rule group cannot be pushed down.
+        :return: None
+        """
+        compiler = GmailQueryCompiler(self)
+        if compiler.query is None:
+            logger.warning(
+                "Rules cannot be pushed down to gmail, evaluating them against the email "
+                "database instead. The results are only as recent as the last "
+                "--import-email run"
+            )
+            self.__filter_data()
+            return
+
+        gmail_obj = GmailApi()
+        message_ids = gmail_obj.list_message_ids(compiler.query)
+        if compiler.exact or not message_ids:
+            self.result = message_ids
+            return
+
+        # The message bodies are downloaded only when a condition matches on them
+        message_format = (
+            "full"
+            if any(each.field_obj.field == "data" for each in self.conditions)
+            else "metadata"
+        )
+        logger.info("Evaluating %s candidate emails locally" % len(message_ids))
+        for each_gmail_data in gmail_obj.get_messages_by_ids(
+            message_ids, message_format
+        ):
+            if self.evaluate(gmail_record(each_gmail_data)):
+                self.result.append(each_gmail_data["id"])
+
     def __filter_data(self):
         """
-        Filters the data based on the condition provided
+        Filters the data based on the condition provided. The in memory conditions are
+        evaluated over the rows returned by the rest of the conditions; for an 'any' group
+        every row could match through them, so the whole group is evaluated in memory.
         :return: list
         """
         session = None
         try:
             session = Session(postgresql_engine)
-            cumulative_where_clause = None
-            for each_rule in self.conditions:
-                if cumulative_where_clause is not None:
-                    if self.rule_group_predicate == "all":
-                        cumulative_where_clause = cumulative_where_clause & (
-                            each_rule.generate_where_clause()
-                        )
-                    elif self.rule_group_predicate == "any":
-                        cumulative_where_clause = cumulative_where_clause | (
-                            each_rule.generate_where_clause()
-                        )
+            memory_conditions = [each for each in self.conditions if each.in_memory]
+            if not memory_conditions:
+                statement = select(EmailMetadata).join(EmailBody)
+                statement = statement.filter(self.__where_clause(self.conditions))
+                if self.diagnostics is not None:
+                    rows = self.diagnostics.execute(session, statement, self.describe())
                 else:
-                    cumulative_where_clause = each_rule.generate_where_clause()
-            statement = (
-                select(EmailMetadata).join(EmailBody).filter(cumulative_where_clause)
-            )
-            rows = session.execute(statement).all()
-            for each in rows:
-                self.result.append(each[0].id)
-            self.result = list(set(self.result))
+                    rows = session.execute(statement).all()
+                self.result = list({each[0].id for each in rows})
+                return
+            self.result = self.__filter_in_memory(session, memory_conditions)
         except Exception:
             session.rollback()
             session.close()
             logger.exception("Error occurred while preparing the filter query")
             raise
 
+    def __where_clause(self, conditions):
+        """
+        Combines the where clauses of the conditions with the rule group predicate
+        :param conditions: list
+        :return: sqlalchemy where
+        """
+        cumulative_where_clause = None
+        for each_rule in conditions:
+            if cumulative_where_clause is not None:
+                if self.rule_group_predicate == "all":
+                    cumulative_where_clause = cumulative_where_clause & (
+                        each_rule.generate_where_clause()
+                    )
+                elif self.rule_group_predicate == "any":
+                    cumulative_where_clause = cumulative_where_clause | (
+                        each_rule.generate_where_clause()
+                    )
+            else:
+                cumulative_where_clause = each_rule.generate_where_clause()
+        return cumulative_where_clause
+
+    def __filter_in_memory(self, session, memory_conditions):
+        """
+        Streams only the columns used by the evaluated conditions and evaluates them in
+        memory. In an 'all' group the other conditions still filter the rows in SQL
+        :param session: sqlalchemy Session
+        :param memory_conditions: list
+        :return: list
+        """
+        if self.rule_group_predicate == "any":
+            evaluated_conditions = self.conditions
+            sql_conditions = []
+        else:
+            evaluated_conditions = memory_conditions
+            sql_conditions = [each for each in self.conditions if not each.in_memory]
+
+        fields = sorted({each.field_obj.field for each in evaluated_conditions})
+        columns = [EmailMetadata.id] + [
+            EmailMetadata.getattr(each) or EmailBody.getattr(each) for each in fields
+        ]
+        statement = select(*columns).join_from(EmailMetadata, EmailBody)
+        if sql_conditions:
+            statement = statement.filter(self.__where_clause(sql_conditions))
+
+        if self.diagnostics is not None:
+            rows = self.diagnostics.execute(session, statement, self.describe())
+        else:
+            result = session.execute(
+                statement, execution_options={"yield_per": STREAM_BATCH_SIZE}
+            )
+            rows = (each for partition in result.partitions() for each in partition)
+
+        matched = set()
+        for each in rows:
+            record = dict(each._mapping)
+            if self.rule_group_predicate == "any":
+                is_match = self.evaluate(record)
+            else:
+                is_match = all(
+                    each_condition.evaluate(record)
+                    for each_condition in evaluated_conditions
+                )
+            if is_match:
+                matched.add(record["id"])
+        return list(matched)
+
     def __apply_action(self):
         """
         Applies the specified action to the gmail
@@ -231,10 +493,13 @@ class ConditionActionGroup:
             logger.info("No matching emails found, hence skipping")
 
 
-def option_builder():
+def option_builder(diagnostics=None, manage_indexes=False, pushdown=False):
     """
     Interactive shell to build the conditions with rules that includes the field, predicate and
      value, then with the move actions with overall conditional predicate
+    :param diagnostics: QueryDiagnostics
+    :param manage_indexes: bool
+    :param pushdown: bool
     :return: None
     """
     print("Condition building: Enter your conditions")
@@ -278,11 +543,18 @@ def option_builder():
         new_action_flag = input("Do you want to add another action? (Yes/No):")
         new_action_flag = new_action_flag == "Yes"
 
-    cond_object = ConditionActionGroup(rule_list, rule_predicate, action_list)
-    cond_object.process_emails()
+    cond_object = ConditionActionGroup(
+        rule_list, rule_predicate, action_list, diagnostics=diagnostics
+    )
+    if manage_indexes:
+        index_manager = IndexManager([cond_object])
+        index_manager.apply(drop_unused=False)
+        index_manager.log_report()
+    cond_object.process_emails(pushdown=pushdown)
 
 
 if __name__ == "__main__":
+    email_db_setup()
     rule1 = Condition(
         Field("email_from"), Predicate("equals"), "founders@dailycodingproblem.com"
     )
@@ -5,8 +5,9 @@ Orchestrates the entire email_processor functionality with different parameter c
 import argparse
 import logging
 
-from src.rule_processor.dao.email_db import email_db_cleanup
+from src.rule_processor.dao.email_db import email_db_cleanup, email_db_setup
 from src.rule_processor.middlewares.email_loader import EmailLoader
+from src.rule_processor.middlewares.query_diagnostics import QueryDiagnostics
 from src.rule_processor.middlewares.rule_engine import option_builder
 
 logging.getLogger("sqlalchemy.engine").setLevel(logging.ERROR)
@@ -20,12 +21,24 @@ def import_email():
     EmailLoader().process()
 
 
-def rule_engine():
+def rule_engine(diagnostics=False, manage_indexes=False, pushdown=False):
     """
     Provides the option builder and evaluates the rules
+    :param diagnostics: bool
+    :param manage_indexes: bool
+    :param pushdown: bool
     :return: None
     """
-    option_builder()
+    if diagnostics:
+        query_diagnostics = QueryDiagnostics()
+        option_builder(
+            diagnostics=query_diagnostics,
+            manage_indexes=bool(manage_indexes),
+            pushdown=bool(pushdown),
+        )
+        query_diagnostics.log_report()
+    else:
+        option_builder(manage_indexes=bool(manage_indexes), pushdown=bool(pushdown))
 
 
 def db_cleanup():
@@ -56,13 +69,37 @@ if __name__ == "__main__":
         help="Allows to configure conditions and do operations",
         type=bool,
     )
+    parser.add_argument(
+        "--diagnostics",
+        nargs="?",
+        help="Captures the generated SQL and query plan of the rules and reports the slow rules",
+        type=bool,
+    )
+    parser.add_argument(
+        "--manage-indexes",
+        nargs="?",
+        help="Creates the indexes required by the configured rules before evaluating them",
+        type=bool,
+    )
+    parser.add_argument(
+        "--gmail-pushdown",
+        nargs="?",
+        help="Lists only the candidate emails with a gmail search query built from the rules",
+        type=bool,
+    )
     # Other contexts
     parser.add_argument("--verbose", nargs="?", help="Provides verbose logs", type=bool)
     args = parser.parse_args()
 
+    email_db_setup()
+
     if args.db_cleanup:
         email_db_cleanup()
     if args.import_email:
         import_email()
     if args.rule_engine:
-        rule_engine()
+        rule_engine(
+            diagnostics=args.diagnostics,
+            manage_indexes=args.manage_indexes,
+            pushdown=args.gmail_pushdown,
+        )
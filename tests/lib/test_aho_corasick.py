@@ -0,0 +1,42 @@
+import random
+import string
+
+from lib.aho_corasick import AhoCorasick
+
+
+def test_search_matches_any_keyword():
+    automaton = AhoCorasick(["he", "she", "hers", "his"])
+    assert automaton.search("uSHers")
+    assert automaton.search("this")
+    assert not automaton.search("hxs")
+
+
+def test_search_matches_keyword_reached_through_failure_link():
+    automaton = AhoCorasick(["abcd", "bc"])
+    assert automaton.search("xabcx")
+
+
+def test_search_without_keywords_or_text():
+    assert not AhoCorasick([]).search("anything")
+    assert not AhoCorasick(["", "a"]).search("")
+    assert not AhoCorasick(["a"]).search(None)
+
+
+def test_search_against_naive_substring_check():
+    rng = random.Random(26)
+    for _ in range(500):
+        keywords = [
+            "".join(rng.choices("abc", k=rng.randint(1, 4)))
+            for _ in range(rng.randint(1, 8))
+        ]
+        text = "".join(rng.choices("abcABC ", k=rng.randint(0, 30)))
+        expected = any(each.lower() in text.lower() for each in keywords)
+        assert AhoCorasick(keywords).search(text) == expected, (keywords, text)
+
+
+def test_search_large_keyword_list():
+    rng = random.Random(10000)
+    keywords = ["".join(rng.choices(string.ascii_lowercase, k=8)) for _ in range(10000)]
+    automaton = AhoCorasick(keywords)
+    assert automaton.search(f"prefix {keywords[-1].upper()} suffix")
+    assert not automaton.search("0123456789")
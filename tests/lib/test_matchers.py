@@ -0,0 +1,64 @@
+import pytest
+
+from lib.matchers import (
+    escape_like,
+    normalise_values,
+    parse_values,
+    sender_address,
+    sender_domain,
+    validate_regex,
+)
+
+
+def test_escape_like_escapes_wildcards():
+    assert escape_like("50%_off") == r"50\%\_off"
+    assert escape_like("a\\b") == r"a\\b"
+    assert escape_like("plain") == "plain"
+
+
+def test_parse_values_comma_separated():
+    assert parse_values(" B@x.com,a@y.com,, b@x.com ") == ["a@y.com", "b@x.com"]
+
+
+def test_parse_values_list():
+    assert parse_values(["Foo", "foo", " ", "bar"]) == ["bar", "foo"]
+
+
+def test_parse_values_file(tmp_path):
+    values_file = tmp_path / "blocklist.txt"
+    values_file.write_text("A@x.com\n\nb@y.com\na@x.com\n")
+    assert parse_values(f"file:{values_file}") == ["a@x.com", "b@y.com"]
+
+
+def test_normalise_values_sender_addresses_for_in_list():
+    values = normalise_values("Foo <A@x.com>, b@y.com", "in_list", "email_from")
+    assert values == ["a@x.com", "b@y.com"]
+
+
+def test_normalise_values_keeps_other_fields_as_is():
+    assert normalise_values("Foo <bar>", "in_list", "subject") == ["foo <bar>"]
+
+
+def test_normalise_values_domain_in():
+    values = normalise_values("@X.com, y.org, @, x.com", "domain_in", "email_from")
+    assert values == ["x.com", "y.org"]
+
+
+def test_sender_address_and_domain():
+    assert sender_address("Foo <a@x.com>") == "a@x.com"
+    assert sender_address("a@x.com") == "a@x.com"
+    assert sender_domain("Foo <a@Mail.x.com>") == "Mail.x.com"
+    assert sender_domain("no address") is None
+
+
+@pytest.mark.parametrize(
+    "pattern", [r"^news.*", r"(?:ab)+c", r"a(?=b)", r"\\b", r"\d+"]
+)
+def test_validate_regex_accepts_shared_syntax(pattern):
+    validate_regex(pattern)
+
+
+@pytest.mark.parametrize("pattern", [r"\bword", r"(?P<n>a)", r"(?<=a)b", r"(?i)a", "["])
+def test_validate_regex_rejects_unsupported_syntax(pattern):
+    with pytest.raises(ValueError):
+        validate_regex(pattern)
@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+
+from googleapiclient.errors import HttpError
+
+from src.rule_processor.middlewares import gmail_apis
+from src.rule_processor.middlewares.gmail_apis import (
+    BATCH_MODIFY_LIMIT,
+    BATCH_RETRIES,
+    GmailApi,
+)
+
+
+class FakeRequest:
+    def execute(self):
+        return ""
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append(request_id)
+
+    def execute(self):
+        for msg_id in self.requests:
+            self.service.attempts[msg_id] = self.service.attempts.get(msg_id, 0) + 1
+            status = self.service.statuses.get(msg_id, [])
+            attempt = self.service.attempts[msg_id]
+            if attempt <= len(status):
+                error = HttpError(
+                    SimpleNamespace(status=status[attempt - 1], reason="error"), b""
+                )
+                self.callback(msg_id, None, error)
+            else:
+                self.callback(msg_id, {"id": msg_id}, None)
+
+
+class FakeService:
+    def __init__(self, statuses=None):
+        self.bodies = []
+        self.statuses = statuses or {}
+        self.attempts = {}
+        self.options = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def batchModify(self, userId, body):
+        self.bodies.append(body)
+        return FakeRequest()
+
+    def get(self, userId, id, **options):
+        self.options.append(options)
+        return FakeRequest()
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+def gmail_api(monkeypatch, service):
+    monkeypatch.setattr(gmail_apis, "build", lambda *args, **kwargs: service)
+    monkeypatch.setattr(gmail_apis.time, "sleep", lambda seconds: None)
+    gmail_obj = GmailApi.__new__(GmailApi)
+    gmail_obj.credentials = None
+    return gmail_obj
+
+
+def test_do_actions_splits_the_ids_into_batch_modify_chunks(monkeypatch):
+    service = FakeService()
+    gmail_obj = gmail_api(monkeypatch, service)
+    ids = [str(each) for each in range(2 * BATCH_MODIFY_LIMIT + 1)]
+    payload = {"addLabelIds": ["INBOX"], "ids": ids}
+
+    gmail_obj.do_actions(payload, "INBOX")
+
+    assert [len(each["ids"]) for each in service.bodies] == [
+        BATCH_MODIFY_LIMIT,
+        BATCH_MODIFY_LIMIT,
+        1,
+    ]
+    assert [each_id for each in service.bodies for each_id in each["ids"]] == ids
+    assert all(each["addLabelIds"] == ["INBOX"] for each in service.bodies)
+    assert payload["ids"] == ids
+
+
+def test_get_messages_by_ids_retries_only_rate_limits_and_server_errors(monkeypatch):
+    service = FakeService({"a": [429], "b": [503, 500], "c": [404], "d": [403]})
+    gmail_obj = gmail_api(monkeypatch, service)
+
+    result = gmail_obj.get_messages_by_ids(["a", "b", "c", "d", "e"])
+
+    assert sorted(each["id"] for each in result) == ["a", "b", "e"]
+    assert service.attempts == {"a": 2, "b": 3, "c": 1, "d": 1, "e": 1}
+
+
+def test_get_messages_by_ids_gives_up_after_the_retries(monkeypatch):
+    service = FakeService({"a": [429] * (BATCH_RETRIES + 1)})
+    gmail_obj = gmail_api(monkeypatch, service)
+
+    assert gmail_obj.get_messages_by_ids(["a"]) == []
+    assert service.attempts == {"a": BATCH_RETRIES + 1}
+
+
+def test_get_messages_by_ids_fetches_only_the_metadata_headers(monkeypatch):
+    service = FakeService()
+    gmail_obj = gmail_api(monkeypatch, service)
+
+    gmail_obj.get_messages_by_ids(["a"], "metadata")
+    gmail_obj.get_messages_by_ids(["b"])
+
+    assert service.options == [
+        {"format": "metadata", "metadataHeaders": ["From", "Subject"]},
+        {"format": "full"},
+    ]
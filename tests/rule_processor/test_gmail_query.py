@@ -0,0 +1,138 @@
+import base64
+from datetime import datetime
+from types import SimpleNamespace
+
+from src.rule_processor.middlewares.gmail_query import (
+    MAX_PUSHDOWN_VALUES,
+    GmailQueryCompiler,
+    gmail_record,
+)
+
+
+def condition(field, predicate, value, time_entity=None):
+    return SimpleNamespace(
+        field_obj=SimpleNamespace(field=field),
+        predicate_obj=SimpleNamespace(predicate=predicate),
+        value=value,
+        time_entity=time_entity,
+    )
+
+
+def rule_group(rule_group_predicate, *conditions):
+    return SimpleNamespace(
+        rule_group_predicate=rule_group_predicate, conditions=list(conditions)
+    )
+
+
+def test_all_group_pushes_sender_and_date_and_keeps_residual():
+    subject = condition("subject", "contains", "cod")
+    compiler = GmailQueryCompiler(
+        rule_group(
+            "all",
+            condition("email_from", "equals", "Daily <founders@daily.com>"),
+            condition("received_date", "less_than", "10", "days"),
+            subject,
+        )
+    )
+    terms = compiler.query.split(" ")
+    assert terms[0] == 'from:("founders@daily.com")'
+    assert terms[1].startswith("after:")
+    assert compiler.residual == [subject]
+    assert not compiler.exact
+
+
+def test_all_group_without_pushable_conditions():
+    compiler = GmailQueryCompiler(
+        rule_group("all", condition("subject", "contains_any", ["a", "b"]))
+    )
+    assert compiler.query is None
+    assert len(compiler.residual) == 1
+
+
+def test_any_group_with_residual_is_not_pushed_down():
+    compiler = GmailQueryCompiler(
+        rule_group(
+            "any",
+            condition("email_from", "domain_in", ["x.com"]),
+            condition("subject", "equals", "hello"),
+        )
+    )
+    assert compiler.query is None
+
+
+def test_any_group_is_or_ed():
+    compiler = GmailQueryCompiler(
+        rule_group(
+            "any",
+            condition("email_from", "in_list", ["a@x.com", "b@y.com"]),
+            condition("received_date", "more_than", "2", "weeks"),
+        )
+    )
+    assert compiler.query.startswith('{from:("a@x.com" OR "b@y.com") before:')
+    assert compiler.query.endswith("}")
+    assert not compiler.residual
+
+
+def test_value_list_cap():
+    values = [f"user{each}@x.com" for each in range(MAX_PUSHDOWN_VALUES)]
+    capped = GmailQueryCompiler(
+        rule_group("all", condition("email_from", "in_list", values))
+    )
+    assert capped.query is not None
+    over_cap = GmailQueryCompiler(
+        rule_group("all", condition("email_from", "in_list", values + ["z@x.com"]))
+    )
+    assert over_cap.query is None
+    assert len(over_cap.residual) == 1
+
+
+def test_values_with_search_syntax_are_not_pushed_down():
+    compiler = GmailQueryCompiler(
+        rule_group("all", condition("email_from", "equals", 'a"b@x.com'))
+    )
+    assert compiler.query is None
+
+
+def test_exact_only_for_date_only_queries():
+    date_only = GmailQueryCompiler(
+        rule_group(
+            "all",
+            condition("received_date", "less_than", "10", "days"),
+            condition("received_date", "more_than", "1", "hours"),
+        )
+    )
+    assert date_only.exact
+    with_sender = GmailQueryCompiler(
+        rule_group(
+            "all",
+            condition("received_date", "less_than", "10", "days"),
+            condition("email_from", "equals", "a@x.com"),
+        )
+    )
+    assert not with_sender.exact
+
+
+def test_gmail_record():
+    body = base64.urlsafe_b64encode("hello world".encode()).decode()
+    record = gmail_record(
+        {
+            "id": "1",
+            "internalDate": "1684380000000",
+            "payload": {
+                "headers": [
+                    {"name": "From", "value": "Foo <a@x.com>"},
+                    {"name": "Subject", "value": "Greetings"},
+                ],
+                "parts": [
+                    {"partId": "0", "body": {"size": 11, "data": body}},
+                    {"partId": "1", "body": {"size": 0}},
+                ],
+            },
+        }
+    )
+    assert record == {
+        "email_from": "Foo <a@x.com>",
+        "subject": "Greetings",
+        "received_date": datetime(2023, 5, 18, 3, 20),
+        "data": "hello world",
+    }
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+from src.rule_processor.dao.index_manager import IndexManager
+from src.rule_processor.middlewares.rule_engine import Condition, Field, Predicate
+
+
+def rule_group(rule_group_predicate, *conditions):
+    return SimpleNamespace(
+        rule_group_predicate=rule_group_predicate,
+        conditions=[
+            Condition(Field(field), Predicate(predicate), value)
+            for field, predicate, value in conditions
+        ],
+    )
+
+
+def test_recommend_derives_the_index_kinds():
+    indexes = IndexManager(
+        [
+            rule_group(
+                "any",
+                ("subject", "contains", "coding"),
+                ("email_from", "domain_in", "x.com"),
+                ("received_date", "less_than", "10 days"),
+            )
+        ]
+    ).recommend()
+    assert {name: each["definition"] for name, each in indexes.items()} == {
+        "ix_rule_email_metadata_subject_trigram": "USING gin (subject gin_trgm_ops)",
+        "ix_rule_email_metadata_email_from_domain": (
+            "USING btree ((lower(substring(email_from, '@([^@> ]+)'))))"
+        ),
+        "ix_rule_email_metadata_received_date_btree": "USING btree (received_date)",
+    }
+
+
+def test_recommend_only_trigram_indexes_on_the_body():
+    indexes = IndexManager(
+        [
+            rule_group(
+                "any",
+                ("data", "equals", "hello"),
+                ("data", "in_list", "a,b"),
+                ("data", "contains", "hello"),
+            )
+        ]
+    ).recommend()
+    assert list(indexes) == ["ix_rule_email_body_data_trigram"]
+    assert indexes["ix_rule_email_body_data_trigram"]["table"] == "email_body"
+
+
+def test_recommend_composite_sender_and_date_index():
+    indexes = IndexManager(
+        [
+            rule_group(
+                "all",
+                ("email_from", "in_list", "a@x.com"),
+                ("received_date", "less_than", "10 days"),
+            )
+        ]
+    ).recommend()
+    composite = indexes[
+        "ix_rule_email_metadata_email_from_received_date_lower_composite"
+    ]
+    assert composite["definition"] == (
+        "USING btree (lower(coalesce(substring(email_from, '<([^<>]+)>'), "
+        "email_from)), received_date)"
+    )
+    assert len(composite["conditions"]) == 2
+
+
+def test_normalise_definition_matches_pg_get_indexdef():
+    assert IndexManager.normalise_definition(
+        "USING btree (lower(coalesce(substring(email_from, '<([^<>]+)>'), email_from)))"
+    ) == IndexManager.normalise_definition(
+        "CREATE INDEX ix_rule_email_metadata_email_from_lower ON public.email_metadata "
+        'USING btree (lower(COALESCE("substring"((email_from)::text, '
+        "'<([^<>]+)>'::text), (email_from)::text)))"
+    )
+    assert IndexManager.normalise_definition(
+        "USING btree (email_from)"
+    ) == IndexManager.normalise_definition(
+        "CREATE INDEX ix_email_metadata_email_from ON public.email_metadata "
+        "USING btree (email_from)"
+    )
+    assert IndexManager.normalise_definition(
+        "USING btree (subject)"
+    ) != IndexManager.normalise_definition(
+        "CREATE INDEX x ON public.email_metadata USING gin (subject gin_trgm_ops)"
+    )
+
+
+def test_find_duplicate_of_the_model_index():
+    existing = {
+        "ix_email_metadata_email_from": {
+            "table": "email_metadata",
+            "definition": "CREATE INDEX ix_email_metadata_email_from ON "
+            "public.email_metadata USING btree (email_from)",
+            "valid": True,
+        },
+        "ix_stale": {
+            "table": "email_metadata",
+            "definition": "CREATE INDEX ix_stale ON public.email_metadata "
+            "USING btree (subject)",
+            "valid": False,
+        },
+    }
+    manager = IndexManager([])
+    sender = {
+        "name": "ix_rule_email_metadata_email_from_btree",
+        "table": "email_metadata",
+        "definition": "USING btree (email_from)",
+    }
+    subject = {
+        "name": "ix_rule_email_metadata_subject_btree",
+        "table": "email_metadata",
+        "definition": "USING btree (subject)",
+    }
+    assert manager.find_duplicate(existing, sender) == "ix_email_metadata_email_from"
+    assert manager.find_duplicate(existing, subject) is None
+
+
+def test_trigram_extension_failure_is_not_fatal():
+    class Connection:
+        def execute(self, statement):
+            raise PermissionError("permission denied to create extension")
+
+    assert not IndexManager.create_trigram_extension(Connection())
@@ -0,0 +1,129 @@
+import json
+
+from src.rule_processor.middlewares.query_diagnostics import QueryDiagnostics
+from src.rule_processor.middlewares.rule_engine import (
+    Condition,
+    ConditionActionGroup,
+    Field,
+    Predicate,
+)
+
+PLAN = {
+    "Plan": {
+        "Node Type": "Hash Join",
+        "Shared Hit Blocks": 12,
+        "Shared Read Blocks": 340,
+        "Plans": [
+            {
+                "Node Type": "Seq Scan",
+                "Relation Name": "email_body",
+                "Rows Removed by Filter": 0,
+            },
+            {
+                "Node Type": "Hash",
+                "Plans": [
+                    {
+                        "Node Type": "Seq Scan",
+                        "Relation Name": "email_metadata",
+                        "Filter": "(((subject)::text ~~* '%coding%'::text) AND "
+                        "(received_date > '2023-05-08 00:00:00'::timestamp))",
+                        "Rows Removed by Filter": 5000,
+                    }
+                ],
+            },
+        ],
+    },
+    "Execution Time": 42.5,
+}
+
+
+def record():
+    return {"seq_scans": [], "missing_indexes": []}
+
+
+def test_filter_columns():
+    assert QueryDiagnostics.filter_columns(
+        "((email_from)::text = 'a'::text) AND (received_date > now())"
+    ) == ["email_from", "received_date"]
+
+
+def test_inspect_plan_flags_the_index_kind_needed():
+    captured = record()
+    indexes = {"email_metadata": ["btreesubject", "btreereceived_date"]}
+    QueryDiagnostics().inspect_plan(PLAN["Plan"], captured, indexes)
+    assert sorted(captured["seq_scans"]) == ["email_body", "email_metadata"]
+    assert captured["missing_indexes"] == ["trigram index on email_metadata(subject)"]
+
+
+def test_inspect_plan_skips_filters_served_by_an_index():
+    captured = record()
+    indexes = {"email_metadata": ["ginsubjectgin_trgm_ops", "btreereceived_date"]}
+    QueryDiagnostics().inspect_plan(PLAN["Plan"], captured, indexes)
+    assert captured["missing_indexes"] == []
+
+
+def test_required_indexes_for_expression_filters():
+    filter_condition = (
+        "(lower(COALESCE(\"substring\"((email_from)::text, '<([^<>]+)>'::text), "
+        "(email_from)::text)) = ANY ('{a@x.com}'::text[]))"
+    )
+    assert QueryDiagnostics().required_indexes(filter_condition) == [
+        ("expression", "email_from")
+    ]
+    assert not QueryDiagnostics.has_index(
+        ["btreeemail_from"], "expression", "email_from"
+    )
+
+
+def test_report_ranks_by_plan_execution_time():
+    diagnostics = QueryDiagnostics()
+    diagnostics.records = [
+        {"rule_group": "fast", "plan_execution_time_ms": 1.0, "execution_time_ms": 90},
+        {"rule_group": "slow", "plan_execution_time_ms": 50.0, "execution_time_ms": 2},
+        {
+            "rule_group": "no plan",
+            "plan_execution_time_ms": None,
+            "execution_time_ms": 9,
+        },
+    ]
+    assert [each["rule_group"] for each in diagnostics.report()] == [
+        "slow",
+        "no plan",
+        "fast",
+    ]
+
+
+def test_format_params_truncates_lists():
+    formatted = QueryDiagnostics.format_params({"param_1": list("abcdefg"), "p": 1})
+    assert formatted == "param_1=[a, b, c, d, e, ... +2 more], p=1"
+
+
+def test_save_writes_the_plans(tmp_path):
+    diagnostics = QueryDiagnostics()
+    diagnostics.records = [
+        {
+            "rule_group": "subject contains coding",
+            "plan": PLAN,
+            "params": {},
+            "plan_execution_time_ms": 42.5,
+            "execution_time_ms": 40.0,
+        }
+    ]
+    path = diagnostics.save(str(tmp_path / "diagnostics.json"))
+    with open(path) as diagnostics_file:
+        assert json.load(diagnostics_file)[0]["plan"] == PLAN
+
+
+def test_describe_includes_the_time_entity_and_truncates_lists():
+    group = ConditionActionGroup(
+        [
+            Condition(Field("received_date"), Predicate("less_than"), "10 days"),
+            Condition(Field("email_from"), Predicate("in_list"), list("abcdefg")),
+        ],
+        "all",
+        [],
+    )
+    assert group.describe() == (
+        "received_date less_than 10 days AND "
+        "email_from in_list [a, b, c, d, e, ... +2 more]"
+    )
@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.rule_processor.middlewares.rule_engine import (
+    IN_MEMORY_VALUES_THRESHOLD,
+    Condition,
+    ConditionActionGroup,
+    Field,
+    Predicate,
+)
+
+
+def condition(field, predicate, value):
+    return Condition(Field(field), Predicate(predicate), value)
+
+
+def compile_clause(each_condition):
+    compiled = each_condition.generate_where_clause().compile(
+        dialect=postgresql.dialect()
+    )
+    return str(compiled), compiled.params
+
+
+def test_validate_splits_the_time_entity():
+    rule = condition("received_date", "less_than", "10 days")
+    assert rule.value == "10"
+    assert rule.time_entity == "days"
+
+
+def test_validate_rejects_invalid_time_config():
+    with pytest.raises(ValueError):
+        condition("received_date", "less_than", "10 fortnights")
+
+
+def test_validate_normalises_list_values():
+    rule = condition("email_from", "in_list", "Foo <A@x.com>, b@y.com")
+    assert rule.value == ["a@x.com", "b@y.com"]
+
+
+def test_validate_rejects_unsupported_regex():
+    with pytest.raises(ValueError):
+        condition("subject", "matches_regex", r"\bword")
+
+
+def test_evaluate_in_list_on_the_sender_address():
+    rule = condition("email_from", "in_list", "a@x.com")
+    assert rule.evaluate({"email_from": "Foo <A@x.com>"})
+    assert rule.evaluate({"email_from": "a@x.com"})
+    assert not rule.evaluate({"email_from": "Foo <b@x.com>"})
+    assert not rule.evaluate({"email_from": None})
+
+
+def test_evaluate_domain_in():
+    rule = condition("email_from", "domain_in", "@X.com")
+    assert rule.evaluate({"email_from": "Foo <a@x.com>"})
+    assert not rule.evaluate({"email_from": "Foo <a@y.com>"})
+
+
+def test_evaluate_contains_any_and_regex():
+    keywords = condition("subject", "contains_any", "invoice, receipt")
+    assert keywords.evaluate({"subject": "Your RECEIPT is ready"})
+    assert not keywords.evaluate({"subject": "Hello"})
+    regex = condition("subject", "matches_regex", r"^\[news\]")
+    assert regex.evaluate({"subject": "[news] weekly"})
+    assert not regex.evaluate({"subject": "weekly [news]"})
+
+
+def test_evaluate_dates_and_missing_date():
+    newer = condition("received_date", "less_than", "10 days")
+    older = condition("received_date", "more_than", "10 days")
+    recent = {"received_date": datetime.now() - timedelta(days=1)}
+    assert newer.evaluate(recent)
+    assert not older.evaluate(recent)
+    assert not newer.evaluate({"received_date": None})
+    assert not older.evaluate({"received_date": None})
+
+
+def test_build_matcher_contains_is_case_insensitive():
+    matcher = Predicate("contains").build_matcher("coding")
+    assert matcher("Daily Coding Problem")
+    assert not matcher(None)
+
+
+def test_condition_action_group_evaluate():
+    rules = [
+        condition("email_from", "in_list", "a@x.com"),
+        condition("subject", "contains_any", "invoice"),
+    ]
+    record = {"email_from": "Foo <a@x.com>", "subject": "Hello"}
+    assert ConditionActionGroup(rules, "any", []).evaluate(record)
+    assert not ConditionActionGroup(rules, "all", []).evaluate(record)
+
+
+def test_in_memory_only_for_long_keyword_lists():
+    short = condition("subject", "contains_any", ["a", "b"])
+    long = condition(
+        "subject",
+        "contains_any",
+        [f"keyword{each}" for each in range(IN_MEMORY_VALUES_THRESHOLD + 1)],
+    )
+    assert not short.in_memory
+    assert long.in_memory
+
+
+def test_in_list_clause_binds_a_single_array():
+    sql, params = compile_clause(condition("email_from", "in_list", "a@x.com,b@y.com"))
+    assert sql == (
+        "lower(coalesce(SUBSTRING(email_metadata.email_from FROM %(substring_1)s), "
+        "email_metadata.email_from)) = ANY (%(param_1)s::TEXT[])"
+    )
+    assert params["substring_1"] == "<([^<>]+)>"
+    assert params["param_1"] == ["a@x.com", "b@y.com"]
+
+
+def test_in_list_clause_on_other_fields_compares_the_value():
+    sql, _ = compile_clause(condition("subject", "in_list", "a,b"))
+    assert sql == "lower(email_metadata.subject) = ANY (%(param_1)s::TEXT[])"
+
+
+def test_domain_in_clause():
+    sql, params = compile_clause(condition("email_from", "domain_in", "x.com"))
+    assert "lower(SUBSTRING(email_metadata.email_from FROM " in sql
+    assert "= ANY (%(param_1)s::TEXT[])" in sql
+    assert params["param_1"] == ["x.com"]
+
+
+def test_contains_any_clause_escapes_like_wildcards():
+    sql, params = compile_clause(condition("subject", "contains_any", "50%_off"))
+    assert sql == "email_metadata.subject ILIKE ANY (%(param_1)s::TEXT[])"
+    assert params["param_1"] == [r"%50\%\_off%"]
+
+
+def test_empty_list_matches_nothing():
+    sql, _ = compile_clause(condition("email_from", "in_list", " , "))
+    assert sql == "false"